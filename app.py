@@ -7,35 +7,42 @@ visualización de la información del autor, usando un diseño de una
 sola columna y contenido enriquecido.
 """
 import streamlit as st
+import copy
 import datetime
-import matplotlib
-matplotlib.use('Agg') # Backend para entornos sin GUI
-import matplotlib.pyplot as plt
+import functools
+import importlib.util
 from io import BytesIO
 import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 
-# --- Importaciones para PDF y Twilio ---
-try:
-    from reportlab.lib.pagesizes import letter
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
-    from reportlab.lib.styles import getSampleStyleSheet
-    from reportlab.lib.units import inch
-    from reportlab.lib import colors
-    IS_PDF_AVAILABLE = True
-except ImportError:
-    IS_PDF_AVAILABLE = False
+# --- Dependencias opcionales (ReportLab, Matplotlib y Twilio se importan bajo demanda) ---
+IS_PDF_AVAILABLE = importlib.util.find_spec("reportlab") is not None
 
-try:
-    from twilio.rest import Client
-    from twilio.base.exceptions import TwilioRestException
-    IS_TWILIO_AVAILABLE = True
-except ImportError:
-    IS_TWILIO_AVAILABLE = False
-    Client, TwilioRestException = None, None
+# --- Lógica de Negocio ---
+def _cpm_kernel(tiempos, pred_idx, orden):
+    """Pasadas hacia adelante y hacia atrás del CPM sobre arreglos contiguos (SoA), en orden topológico."""
+    n = tiempos.shape[0]
+    es, ef = np.zeros(n), np.zeros(n)
+    for i in orden:
+        p = pred_idx[i]
+        es[i] = ef[p] if p >= 0 else 0.0
+        ef[i] = es[i] + tiempos[i]
+    total = ef.max() if n else 0.0
+    lf, ls = np.full(n, total), np.zeros(n)
+    for i in orden[::-1]:
+        ls[i] = lf[i] - tiempos[i]
+        p = pred_idx[i]
+        if p >= 0 and ls[i] < lf[p]:
+            lf[p] = ls[i]
+    return es, ef, ls, lf
 
-# --- Lógica de Negocio (Clases sin cambios) ---
 class Estacion:
     """Representa una estación de trabajo."""
+    __slots__ = ('nombre', 'tiempo', 'predecesora_nombre', 'es', 'ef', 'ls', 'lf', 'holgura', 'es_critica')
     def __init__(self, nombre, tiempo, predecesora_nombre=""):
         if not isinstance(tiempo, (int, float)) or tiempo <= 0:
             raise ValueError(f"El tiempo para la estación '{nombre}' debe ser un número positivo.")
@@ -59,41 +66,68 @@ class LineaProduccion:
         self.tiempo_produccion_total_estimado = 0.0
         self.eficiencia_linea = 0.0
         self.cuello_botella_info = {}
-        self.empleados_asignados_por_estacion = []
         self.tasa_produccion = 0.0
         self.tiempo_inactivo_total = 0.0
 
+    @staticmethod
+    def _clave(nombre):
+        """Clave normalizada con la que se indexan y comparan los nombres de estación."""
+        return nombre.strip().casefold()
+
     def _procesar_estaciones_data(self, estaciones_data):
-        nombres_vistos = set()
+        # La tabla editable permite borrar todas las filas (el botón "Quitar Última" se deshabilitaba con una sola estación).
+        if not estaciones_data: raise ValueError("Debe definir al menos una estación.")
         for data in estaciones_data:
             nombre = data.get("nombre")
-            if not nombre: raise ValueError("Todas las estaciones deben tener un nombre.")
-            if nombre.lower() in nombres_vistos: raise ValueError(f"Nombre de estación duplicado: '{nombre}'.")
-            nombres_vistos.add(nombre.lower())
+            clave = self._clave(nombre) if nombre else ""
+            # Un nombre solo de espacios también queda vacío; "" está reservado para "sin predecesora".
+            if not clave: raise ValueError("Todas las estaciones deben tener un nombre.")
+            if clave in self.estaciones_dict: raise ValueError(f"Nombre de estación duplicado: '{nombre}'.")
             est = Estacion(nombre, data.get("tiempo"), data.get("predecesora", ""))
             self.estaciones_lista.append(est)
-            self.estaciones_dict[nombre] = est
-        for est in self.estaciones_lista:
-            if est.predecesora_nombre and est.predecesora_nombre not in self.estaciones_dict:
+            self.estaciones_dict[clave] = est
+        claves_pred = [self._clave(est.predecesora_nombre) if est.predecesora_nombre else "" for est in self.estaciones_lista]
+        for est, clave_pred in zip(self.estaciones_lista, claves_pred):
+            if clave_pred and clave_pred not in self.estaciones_dict:
                 raise ValueError(f"La predecesora '{est.predecesora_nombre}' para '{est.nombre}' no existe.")
+            # Las opciones de predecesora son comunes a toda la columna, así que incluyen el nombre de la propia fila.
+            if clave_pred == self._clave(est.nombre):
+                raise ValueError(f"La estación '{est.nombre}' no puede ser su propia predecesora.")
+        self.sucesores_dict = {clave: [] for clave in self.estaciones_dict}
+        for clave, clave_pred in zip(self.estaciones_dict, claves_pred):
+            if clave_pred:
+                self.sucesores_dict[clave_pred].append(clave)
+        indices = {clave: i for i, clave in enumerate(self.estaciones_dict)}
+        self.tiempos = np.fromiter((est.tiempo for est in self.estaciones_lista), dtype=np.float64, count=len(self.estaciones_lista))
+        self.sum_tiempos = sum(self.tiempos.tolist()) # suma secuencial, igual que la versión por estación (np.sum redondea por bloques)
+        self.pred_idx = np.array([indices[c] if c else -1 for c in claves_pred], dtype=np.int64)
+        self.orden_topologico = self._ordenar_topologicamente(indices)
+
+    def _ordenar_topologicamente(self, indices):
+        """Algoritmo de Kahn: el CPM no depende del orden en que se capturaron las estaciones."""
+        claves = list(indices)
+        pendientes = deque(i for i, p in enumerate(self.pred_idx.tolist()) if p < 0)
+        orden = []
+        while pendientes:
+            i = pendientes.popleft()
+            orden.append(i)
+            pendientes.extend(indices[c] for c in self.sucesores_dict[claves[i]])
+        if len(orden) != len(self.estaciones_lista):
+            raise ValueError("Se detectó un ciclo en las precedencias de las estaciones.")
+        return np.array(orden, dtype=np.int64)
 
     def calcular_cpm(self):
-        for est in self.estaciones_lista:
-            pred = self.estaciones_dict.get(est.predecesora_nombre)
-            est.es = pred.ef if pred else 0
-            est.ef = est.es + est.tiempo
-        self.tiempo_total_camino_critico = max((est.ef for est in self.estaciones_lista), default=0.0)
-        for est in reversed(self.estaciones_lista):
-            sucesores = [s for s in self.estaciones_lista if s.predecesora_nombre == est.nombre]
-            est.lf = min((s.ls for s in sucesores), default=self.tiempo_total_camino_critico)
-            est.ls = est.lf - est.tiempo
-            est.holgura = est.ls - est.es
-            if abs(est.holgura) < 1e-6:
-                est.es_critica = True
-        self.camino_critico_nombres = sorted([est.nombre for est in self.estaciones_lista if est.es_critica])
+        self.es_arr, self.ef_arr, self.ls_arr, self.lf_arr = _cpm_kernel(self.tiempos, self.pred_idx, self.orden_topologico)
+        self.holgura_arr = self.ls_arr - self.es_arr
+        self.critica_mask = np.abs(self.holgura_arr) < 1e-6
+        self.tiempo_total_camino_critico = float(self.ef_arr.max(initial=0.0))
+        columnas = zip(self.es_arr.tolist(), self.ef_arr.tolist(), self.ls_arr.tolist(), self.lf_arr.tolist(), self.holgura_arr.tolist(), self.critica_mask.tolist())
+        for est, (es, ef, ls, lf, holgura, critica) in zip(self.estaciones_lista, columnas):
+            est.es, est.ef, est.ls, est.lf, est.holgura, est.es_critica = es, ef, ls, lf, holgura, critica
+        self.camino_critico_nombres = sorted(self.estaciones_lista[i].nombre for i in np.flatnonzero(self.critica_mask).tolist())
         if self.estaciones_lista:
-            cuello_botella = max(self.estaciones_lista, key=lambda e: e.tiempo)
-            self.cuello_botella_info = {"nombre": cuello_botella.nombre, "tiempo_proceso_individual": cuello_botella.tiempo}
+            idx_cuello = int(self.tiempos.argmax())
+            self.cuello_botella_info = {"nombre": self.estaciones_lista[idx_cuello].nombre, "tiempo_proceso_individual": float(self.tiempos[idx_cuello])}
 
     def calcular_metricas_avanzadas(self):
         tiempo_cuello_botella = self.cuello_botella_info.get("tiempo_proceso_individual", 0)
@@ -105,73 +139,157 @@ class LineaProduccion:
             self.tiempo_produccion_total_estimado = self.tiempo_total_camino_critico
             self.tasa_produccion = 0.0
         
-        sum_tiempos = sum(est.tiempo for est in self.estaciones_lista)
         denominador = len(self.estaciones_lista) * tiempo_cuello_botella
-        self.eficiencia_linea = (sum_tiempos / denominador) * 100 if denominador > 0 else 0.0
-        self.tiempo_inactivo_total = sum(est.holgura for est in self.estaciones_lista if not est.es_critica)
+        self.eficiencia_linea = (self.sum_tiempos / denominador) * 100 if denominador > 0 else 0.0
+        self.tiempo_inactivo_total = sum(self.holgura_arr[~self.critica_mask].tolist())
 
     def asignar_empleados(self):
-        total_tiempo = sum(est.tiempo for est in self.estaciones_lista)
+        total_tiempo = self.sum_tiempos
         if total_tiempo == 0 or self.num_empleados_disponibles == 0:
-            self.empleados_asignados_por_estacion = [{"nombre": e.nombre, "empleados": 0} for e in self.estaciones_lista]
+            self.empleados_arr = np.zeros(len(self.estaciones_lista), dtype=np.int64)
             return
-        asignaciones = [{'nombre': e.nombre, 'ideal': e.tiempo / total_tiempo * self.num_empleados_disponibles} for e in self.estaciones_lista]
-        for a in asignaciones: a['base'], a['fraccion'] = int(a['ideal']), a['ideal'] - int(a['ideal'])
-        restantes = self.num_empleados_disponibles - sum(a['base'] for a in asignaciones)
-        asignaciones.sort(key=lambda x: x['fraccion'], reverse=True)
-        for i in range(min(restantes, len(asignaciones))): asignaciones[i]['base'] += 1
-        mapa = {a['nombre']: a['base'] for a in asignaciones}
-        self.empleados_asignados_por_estacion = [{"nombre": e.nombre, "empleados": mapa.get(e.nombre, 0)} for e in self.estaciones_lista]
-    
-    def ejecutar_calculos(self):
-        self.calcular_cpm()
-        self.calcular_metricas_avanzadas()
-        self.asignar_empleados()
+        # Método de Hamilton (restos mayores): parte entera y luego los restantes a las fracciones más altas.
+        ideal = self.tiempos / total_tiempo * self.num_empleados_disponibles
+        base = ideal.astype(np.int64)
+        restantes = self.num_empleados_disponibles - int(base.sum())
+        orden = np.argsort(-(ideal - base), kind='stable') # estable: en empate gana la estación capturada antes
+        base[orden[:restantes]] += 1
+        self.empleados_arr = base
+
+@st.cache_resource(show_spinner=False, ttl=24*60*60, max_entries=128)
+def calcular_cpm_linea(estaciones_tuple):
+    """Construye la línea y resuelve el CPM; solo depende de la tupla (nombre, tiempo, predecesora).
+
+    El objeto se comparte entre reruns y sesiones: no debe mutarse, sino copiarse.
+    """
+    estaciones_data = [{"nombre": n, "tiempo": t, "predecesora": p} for n, t, p in estaciones_tuple]
+    linea = LineaProduccion(estaciones_data, 0, 0)
+    linea.calcular_cpm()
+    return linea
+
+def calcular_balanceo(estaciones_tuple, unidades, empleados):
+    """Completa métricas y asignación sobre una copia del CPM en caché; cambiar solo unidades/empleados no repite el CPM."""
+    linea = copy.copy(calcular_cpm_linea(estaciones_tuple))
+    linea.unidades_a_producir = unidades
+    linea.num_empleados_disponibles = empleados
+    linea.calcular_metricas_avanzadas()
+    linea.asignar_empleados()
+    return linea
+
+def construir_tablas_resultados(linea):
+    """Tablas de las pestañas CPM y Personal, armadas una vez por resultado a partir de los arreglos de la línea."""
+    nombres = [est.nombre for est in linea.estaciones_lista]
+    cpm_df = pd.DataFrame({
+        "Estación": nombres, "Tiempo": linea.tiempos, "ES": linea.es_arr, "EF": linea.ef_arr,
+        "LS": linea.ls_arr, "LF": linea.lf_arr, "Holgura": linea.holgura_arr, "Crítica": np.where(linea.critica_mask, "🔴 Sí", "🟢 No")
+    })
+    empleados_df = pd.DataFrame({"nombre": nombres, "empleados": linea.empleados_arr})
+    return cpm_df, empleados_df
 
 # --- Lógica de Twilio Reintegrada ---
 LOW_EFFICIENCY_THRESHOLD = 85
 
+@st.cache_resource
 def inicializar_twilio_client():
-    if not IS_TWILIO_AVAILABLE: return None
+    """Configuración de Twilio compartida por todas las sesiones: (cliente, número origen, número destino), o None si no está configurado."""
     try:
-        if hasattr(st, 'secrets') and all(k in st.secrets for k in ["TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN"]):
-            account_sid = st.secrets["TWILIO_ACCOUNT_SID"]
-            auth_token = st.secrets["TWILIO_AUTH_TOKEN"]
-            if account_sid.startswith("AC") and len(auth_token) > 30:
-                st.session_state.twilio_configured = True
-                return Client(account_sid, auth_token)
+        account_sid = st.secrets.get("TWILIO_ACCOUNT_SID", "")
+        auth_token = st.secrets.get("TWILIO_AUTH_TOKEN", "")
+        from_number = st.secrets.get("TWILIO_WHATSAPP_FROM_NUMBER", "")
+        to_number = st.secrets.get("DESTINATION_WHATSAPP_NUMBER", "")
+        if account_sid.startswith("AC") and len(auth_token) > 30 and from_number and to_number:
+            # Importación diferida: sin credenciales no se paga el coste de cargar twilio/requests.
+            from twilio.rest import Client
+            return Client(account_sid, auth_token), from_number, to_number
     except Exception:
         pass
-    st.session_state.twilio_configured = False
     return None
 
+@st.cache_resource
+def obtener_executor_twilio():
+    """Pool compartido para enviar las alertas sin bloquear el rerun de Streamlit."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="twilio")
+
+def crear_mensaje_con_reintentos(twilio_client, intentos=3, **datos_mensaje):
+    """Se ejecuta en el pool: reintenta con espera exponencial (y algo de azar) ante 429 o errores 5xx de Twilio."""
+    from twilio.base.exceptions import TwilioRestException
+    for intento in range(intentos):
+        try:
+            return twilio_client.messages.create(**datos_mensaje)
+        except TwilioRestException as e:
+            if intento == intentos - 1 or not (e.status == 429 or e.status >= 500):
+                raise
+            time.sleep(0.5 * 2 ** intento + random.uniform(0, 0.25))
+
 def enviar_alerta_whatsapp(mensaje):
-    if 'twilio_client' not in st.session_state or not st.session_state.twilio_client:
-        return
-    if not st.session_state.get('twilio_configured'):
-        st.warning("Credenciales de Twilio no configuradas.", icon="⚠️")
+    config_twilio = inicializar_twilio_client()
+    if config_twilio is None:
         return
+    twilio_client, from_number, to_number = config_twilio
     try:
-        from_number = st.secrets["TWILIO_WHATSAPP_FROM_NUMBER"]
-        to_number = st.secrets["DESTINATION_WHATSAPP_NUMBER"]
         codigo_aleatorio = random.randint(100000, 999999)
         mensaje_final = f"Your Twilio code is {codigo_aleatorio}\n\n{mensaje}"
-        st.session_state.twilio_client.messages.create(
+        futuro = obtener_executor_twilio().submit(
+            crear_mensaje_con_reintentos, twilio_client,
             from_=f'whatsapp:{from_number}', body=mensaje_final, to=f'whatsapp:{to_number}'
         )
-        st.toast(f"¡Alerta enviada a {to_number}!", icon="✅")
-    except TwilioRestException as e:
-        st.error(f"Error de Twilio: {e.msg}", icon="🚨")
-        if e.code == 21608: st.warning("Reactiva tu Sandbox de WhatsApp.", icon="📱")
+        st.session_state.setdefault('alertas_pendientes', []).append((futuro, to_number))
     except Exception as e:
         st.error(f"Error inesperado al enviar WhatsApp: {e}", icon="🚨")
 
+def revisar_alertas_whatsapp():
+    """Informa el resultado de los envíos en segundo plano que ya terminaron."""
+    if not st.session_state.get('alertas_pendientes'):
+        return
+    from twilio.base.exceptions import TwilioRestException
+    pendientes = []
+    for futuro, to_number in st.session_state.get('alertas_pendientes', []):
+        if not futuro.done():
+            pendientes.append((futuro, to_number))
+            continue
+        try:
+            futuro.result()
+            st.toast(f"¡Alerta enviada a {to_number}!", icon="✅")
+        except TwilioRestException as e:
+            st.error(f"Error de Twilio: {e.msg}", icon="🚨")
+            if e.code == 21608: st.warning("Reactiva tu Sandbox de WhatsApp.", icon="📱")
+        except Exception as e:
+            st.error(f"Error inesperado al enviar WhatsApp: {e}", icon="🚨")
+    st.session_state.alertas_pendientes = pendientes
+
 # --- Funciones de Generación (Gráficos, PDF) ---
+@st.cache_data(show_spinner=False, max_entries=128)
+def generar_graficos_png(nombres, tiempos, empleados):
+    """Renderiza los gráficos de tiempos y empleados en una sola figura y devuelve sus bytes PNG (None si no hay estaciones)."""
+    if not nombres:
+        return None
+    # API orientada a objetos: sin el estado global de pyplot ni backend interactivo, y sin tener que cerrar la figura.
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(10, 4), layout='constrained')
+    ax1, ax2 = fig.subplots(1, 2)
+    ax1.pie(tiempos, labels=nombres, autopct='%1.1f%%'); ax1.axis('equal'); ax1.set_title('Tiempos')
+    ax2.bar(nombres, empleados); ax2.set_title('Empleados'); ax2.tick_params(axis='x', labelrotation=45)
+    buf = BytesIO(); fig.savefig(buf, format='PNG', dpi=90, pil_kwargs={'compress_level': 1}) # ReportLab vuelve a comprimir la imagen al incrustarla
+    return buf.getvalue()
+
+@st.cache_resource
+def obtener_estilos_pdf():
+    """Hoja de estilos y estilos de tabla del reporte: se crean una sola vez por proceso."""
+    from reportlab.platypus import TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib import colors
+    estilo_kpi = TableStyle([('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold')])
+    estilo_cpm = TableStyle([('BACKGROUND', (0,0), (-1,0), colors.grey), ('GRID', (0,0), (-1,-1), 1, colors.black)])
+    return getSampleStyleSheet(), estilo_kpi, estilo_cpm
+
 def generar_reporte_pdf(linea_obj):
     if not IS_PDF_AVAILABLE: return None
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table
+    from reportlab.lib.units import inch
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=inch*0.5, bottomMargin=inch*0.5)
-    styles = getSampleStyleSheet()
+    styles, estilo_kpi, estilo_cpm = obtener_estilos_pdf()
     story = []
     story.append(Paragraph("Reporte de Optimización de Línea", styles['h1']))
     story.append(Spacer(1, 0.2*inch))
@@ -179,31 +297,47 @@ def generar_reporte_pdf(linea_obj):
         ["Eficiencia de Línea:", f"{linea_obj.eficiencia_linea:.2f}%"], ["Tiempo de Ciclo:", f"{linea_obj.tiempo_ciclo_calculado:.2f} min/ud"],
         ["Tasa de Producción:", f"{linea_obj.tasa_produccion:.2f} uds/hora"], ["Tiempo Inactivo Total:", f"{linea_obj.tiempo_inactivo_total:.2f} min"]
     ]
-    story.append(Table(kpi_data, style=[('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold')]))
+    story.append(Table(kpi_data, style=estilo_kpi))
     story.append(Spacer(1, 0.2*inch))
     story.append(Paragraph("Detalle de la Ruta Crítica (CPM)", styles['h2']))
     cpm_header = ["Estación", "Tiempo", "ES", "EF", "LS", "LF", "Holgura", "Crítica"]
-    cpm_data = [cpm_header] + [[est.nombre, f"{est.tiempo:.2f}", f"{est.es:.2f}", f"{est.ef:.2f}", f"{est.ls:.2f}", f"{est.lf:.2f}", f"{est.holgura:.2f}", "Sí" if est.es_critica else "No"] for est in linea_obj.estaciones_lista]
-    story.append(Table(cpm_data, style=[('BACKGROUND', (0,0), (-1,0), colors.grey), ('GRID', (0,0), (-1,-1), 1, colors.black)]))
-    fig_pie, ax1 = plt.subplots(); ax1.pie([e.tiempo for e in linea_obj.estaciones_lista], labels=[e.nombre for e in linea_obj.estaciones_lista], autopct='%1.1f%%'); ax1.axis('equal'); ax1.set_title('Tiempos')
-    fig_bar, ax2 = plt.subplots(); ax2.bar([a['nombre'] for a in linea_obj.empleados_asignados_por_estacion], [a['empleados'] for a in linea_obj.empleados_asignados_por_estacion]); ax2.set_title('Empleados'); plt.xticks(rotation=45)
-    charts = []
-    for fig in [fig_pie, fig_bar]:
-        buf = BytesIO(); fig.savefig(buf, format='PNG'); buf.seek(0)
-        charts.append(Image(buf, width=3.5*inch, height=2.8*inch))
-    story.append(Table([charts])); doc.build(story); buffer.seek(0)
+    # Las seis columnas numéricas se formatean de una vez sobre la matriz N×6.
+    numeros = np.char.mod('%.2f', np.column_stack((linea_obj.tiempos, linea_obj.es_arr, linea_obj.ef_arr, linea_obj.ls_arr, linea_obj.lf_arr, linea_obj.holgura_arr))).tolist()
+    cpm_data = [cpm_header] + [[est.nombre, *fila, "Sí" if c else "No"] for est, fila, c in zip(linea_obj.estaciones_lista, numeros, linea_obj.critica_mask.tolist())]
+    story.append(Table(cpm_data, style=estilo_cpm))
+    graficos_png = generar_graficos_png(
+        tuple(e.nombre for e in linea_obj.estaciones_lista), tuple(linea_obj.tiempos.tolist()), tuple(linea_obj.empleados_arr.tolist())
+    )
+    if graficos_png:
+        story.append(Image(BytesIO(graficos_png), width=7*inch, height=2.8*inch, kind='proportional'))
+    doc.build(story); buffer.seek(0)
     return buffer.getvalue()
 
+def obtener_pdf_resultado(resultados):
+    """Construye el PDF de un resultado la primera vez que se descarga y reutiliza sus bytes en las siguientes."""
+    if 'pdf' not in resultados:
+        resultados['pdf'] = generar_reporte_pdf(resultados['linea_obj'])
+    return resultados['pdf']
+
 # --- Configuración Inicial y Estado ---
 st.set_page_config(page_title="Optimizador de Líneas", layout="wide", page_icon="🏭")
-if 'estaciones' not in st.session_state:
-    st.session_state.estaciones = [
+def estaciones_por_defecto():
+    return [
         {'nombre': 'Corte', 'tiempo': 2.0, 'predecesora': ''}, {'nombre': 'Doblado', 'tiempo': 3.0, 'predecesora': 'Corte'},
         {'nombre': 'Ensamblaje', 'tiempo': 5.0, 'predecesora': 'Doblado'}, {'nombre': 'Pintura', 'tiempo': 4.0, 'predecesora': 'Ensamblaje'},
         {'nombre': 'Empaque', 'tiempo': 1.5, 'predecesora': 'Pintura'}
     ]
-if 'twilio_client' not in st.session_state:
-    st.session_state.twilio_client = inicializar_twilio_client()
+
+def resetear_estado():
+    """Callback del botón Resetear: se ejecuta antes del rerun del clic, por lo que no hace falta un st.rerun() extra."""
+    st.session_state.results = None
+    st.session_state.estaciones = estaciones_por_defecto()
+    st.session_state.version_editor += 1
+
+if 'estaciones' not in st.session_state:
+    st.session_state.estaciones = estaciones_por_defecto()
+st.session_state.setdefault('version_editor', 0)
+revisar_alertas_whatsapp()
 
 # --- INTERFAZ PRINCIPAL CON PESTAÑAS ---
 st.title("🏭 Optimizador Avanzado de Líneas de Producción")
@@ -212,56 +346,55 @@ tab_optimizador, tab_acerca_de = st.tabs(["🚀 Optimizador", "ℹ️ Acerca de"
 # --- Pestaña del Optimizador ---
 with tab_optimizador:
     with st.expander("⚙️ **Haga clic para configurar la simulación y las estaciones**", expanded=True):
-        col_params, col_actions = st.columns([1, 1])
-        with col_params:
-            unidades = st.number_input("Unidades a Producir", 1, value=100, step=10)
-            empleados = st.number_input("Empleados Disponibles", 1, value=5, step=1)
-        with col_actions:
-            st.subheader("Gestionar Estaciones")
-            c1, c2 = st.columns(2)
-            if c1.button("➕ Añadir Estación", use_container_width=True, key="add_station"):
-                st.session_state.estaciones.append({'nombre': '', 'tiempo': 1.0, 'predecesora': ''})
-                st.rerun()
-            if c2.button("➖ Quitar Última", use_container_width=True, disabled=len(st.session_state.estaciones) <= 1, key="remove_station"):
-                st.session_state.estaciones.pop()
-                st.rerun()
-
-        st.subheader("Definición de Estaciones")
-        cols = st.columns(max(1, len(st.session_state.estaciones)))
-        for i, est in enumerate(st.session_state.estaciones):
-            with cols[i % len(cols)]:
-                st.markdown(f"**Estación {i+1}**")
-                st.session_state.estaciones[i]['nombre'] = st.text_input("Nombre", est['nombre'], key=f"nombre_{i}")
-                st.session_state.estaciones[i]['tiempo'] = st.number_input("Tiempo (min)", 0.01, value=est['tiempo'], key=f"tiempo_{i}")
-                opts = [""] + [e['nombre'] for j, e in enumerate(st.session_state.estaciones) if i != j and e['nombre']]
-                st.session_state.estaciones[i]['predecesora'] = st.selectbox("Predecesora", opts, index=(opts.index(est['predecesora']) if est['predecesora'] in opts else 0), key=f"pred_{i}")
-
-    c1, c2, c3 = st.columns([2, 1, 1])
-    if c1.button("🚀 Calcular y Optimizar", type="primary", use_container_width=True, key="calculate"):
+        # Los widgets del formulario solo provocan un rerun al pulsar "Calcular y Optimizar".
+        with st.form("form_estaciones", border=False):
+            col_unidades, col_empleados = st.columns(2)
+            unidades = col_unidades.number_input("Unidades a Producir", 1, value=100, step=10)
+            empleados = col_empleados.number_input("Empleados Disponibles", 1, value=5, step=1)
+            st.subheader("Definición de Estaciones")
+            # Una sola tabla editable (con alta/baja de filas nativa) en lugar de tres widgets por estación.
+            df_estaciones = pd.DataFrame(st.session_state.estaciones, columns=['nombre', 'tiempo', 'predecesora'])
+            estaciones_editadas = st.data_editor(
+                df_estaciones, num_rows="dynamic", hide_index=True, use_container_width=True, key=f"editor_estaciones_{st.session_state.version_editor}",
+                column_config={
+                    "nombre": st.column_config.TextColumn("Nombre", required=True),
+                    "tiempo": st.column_config.NumberColumn("Tiempo (min)", min_value=0.01, default=1.0, format="%.2f", required=True),
+                    "predecesora": st.column_config.SelectboxColumn("Predecesora", options=[""] + list(dict.fromkeys(n for n in df_estaciones['nombre'] if n)), default=""),
+                })
+            st.caption("Las estaciones nuevas o renombradas aparecen como opción de predecesora después de pulsar \"Calcular y Optimizar\".")
+            calcular = st.form_submit_button("🚀 Calcular y Optimizar", type="primary", use_container_width=True, key="calculate")
+
+    c2, c3 = st.columns(2)
+    if calcular:
+        # Las celdas vacías de filas nuevas llegan como None/NaN; se normalizan antes de guardarlas.
+        st.session_state.estaciones = estaciones_editadas.fillna({'nombre': '', 'tiempo': 1.0, 'predecesora': ''}).to_dict("records")
+        # Nueva clave del editor: la tabla se reconstruye con los datos guardados (y opciones de predecesora al día).
+        st.session_state.version_editor += 1
         try:
-            linea = LineaProduccion(st.session_state.estaciones, unidades, empleados)
-            linea.ejecutar_calculos()
-            st.session_state.results = {"linea_obj": linea}
+            estaciones_tuple = tuple((e['nombre'], e['tiempo'], e['predecesora']) for e in st.session_state.estaciones)
+            huella = (estaciones_tuple, unidades, empleados)
+            # Con las mismas entradas se conserva el resultado vigente (y su PDF) en lugar de recalcular y reenviar la alerta.
+            huella_previa = (st.session_state.get('results') or {}).get('huella')
+            if huella_previa != huella:
+                linea = calcular_balanceo(estaciones_tuple, unidades, empleados)
+                cpm_df, empleados_df = construir_tablas_resultados(linea)
+                st.session_state.results = {"linea_obj": linea, "huella": huella, "cpm_df": cpm_df, "empleados_df": empleados_df}
+                # Si solo se re-enlazan predecesoras (mismos pares nombre/tiempo, unidades y empleados) la eficiencia no cambia: no se reenvía la alerta.
+                solo_predecesoras = huella_previa is not None and [e[:2] for e in huella_previa[0]] == [e[:2] for e in estaciones_tuple] and huella_previa[1:] == huella[1:]
+                if linea.eficiencia_linea < LOW_EFFICIENCY_THRESHOLD and not solo_predecesoras:
+                    mensaje = f"¡Alerta! Eficiencia baja: {linea.eficiencia_linea:.1f}%. Cuello de botella: '{linea.cuello_botella_info.get('nombre', 'N/A')}'."
+                    enviar_alerta_whatsapp(mensaje)
             st.success("¡Análisis completado!")
-            if linea.eficiencia_linea < LOW_EFFICIENCY_THRESHOLD:
-                mensaje = f"¡Alerta! Eficiencia baja: {linea.eficiencia_linea:.1f}%. Cuello de botella: '{linea.cuello_botella_info.get('nombre', 'N/A')}'."
-                enviar_alerta_whatsapp(mensaje)
         except Exception as e:
             st.error(f"Error en el cálculo: {e}")
             st.session_state.results = None
 
     if 'results' in st.session_state and st.session_state.results:
-        if c2.download_button("📄 Descargar PDF", generar_reporte_pdf(st.session_state.results['linea_obj']), "reporte_balanceo.pdf", "application/pdf", use_container_width=True, key="download"):
+        # Descarga diferida: el PDF solo se construye si el usuario pulsa el botón.
+        if c2.download_button("📄 Descargar PDF", functools.partial(obtener_pdf_resultado, st.session_state.results), "reporte_balanceo.pdf", "application/pdf", use_container_width=True, key="download"):
             pass
 
-    if c3.button("🔄 Resetear", use_container_width=True, key="reset"):
-        st.session_state.results = None
-        st.session_state.estaciones = [
-            {'nombre': 'Corte', 'tiempo': 2.0, 'predecesora': ''}, {'nombre': 'Doblado', 'tiempo': 3.0, 'predecesora': 'Corte'},
-            {'nombre': 'Ensamblaje', 'tiempo': 5.0, 'predecesora': 'Doblado'}, {'nombre': 'Pintura', 'tiempo': 4.0, 'predecesora': 'Ensamblaje'},
-            {'nombre': 'Empaque', 'tiempo': 1.5, 'predecesora': 'Pintura'}
-        ]
-        st.rerun()
+    c3.button("🔄 Resetear", use_container_width=True, key="reset", on_click=resetear_estado)
 
     if 'results' in st.session_state and st.session_state.results:
         linea_res = st.session_state.results['linea_obj']
@@ -278,13 +411,14 @@ with tab_optimizador:
         with res_tab1:
             cb_nombre = linea_res.cuello_botella_info.get('nombre', 'N/A')
             st.info(f"**Cuello de Botella:** Estación **'{cb_nombre}'** ({linea_res.tiempo_ciclo_calculado:.2f} min).", icon="⚠️")
-            candidatas = sorted([est for est in linea_res.estaciones_lista if not est.es_critica], key=lambda x: x.holgura, reverse=True)
-            if linea_res.eficiencia_linea < 85 and candidatas:
-                st.warning(f"**Sugerencia:** Redistribuir tareas desde '{cb_nombre}' hacia **'{candidatas[0].nombre}'** (holgura de {candidatas[0].holgura:.2f} min).", icon="🛠️")
+            # Solo interesa la estación no crítica con más holgura: un argmax en lugar de ordenar todas.
+            if linea_res.eficiencia_linea < LOW_EFFICIENCY_THRESHOLD and not linea_res.critica_mask.all():
+                candidata = linea_res.estaciones_lista[int(np.where(linea_res.critica_mask, -np.inf, linea_res.holgura_arr).argmax())]
+                st.warning(f"**Sugerencia:** Redistribuir tareas desde '{cb_nombre}' hacia **'{candidata.nombre}'** (holgura de {candidata.holgura:.2f} min).", icon="🛠️")
         with res_tab2:
-            st.dataframe([{"Estación": est.nombre, "Tiempo": est.tiempo, "ES": est.es, "EF": est.ef, "LS": est.ls, "LF": est.lf, "Holgura": f"{est.holgura:.2f}", "Crítica": "🔴 Sí" if est.es_critica else "🟢 No"} for est in linea_res.estaciones_lista])
+            st.dataframe(st.session_state.results['cpm_df'], column_config={"Holgura": st.column_config.NumberColumn(format="%.2f")})
         with res_tab3:
-            st.dataframe(linea_res.empleados_asignados_por_estacion)
+            st.dataframe(st.session_state.results['empleados_df'])
 
 # --- Pestaña de "Acerca de" ---
 with tab_acerca_de: